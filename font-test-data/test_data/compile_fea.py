@@ -11,10 +11,13 @@ VARFONT_AXES = [
     ("wdth", 100, 100, 200, "Width"),
 ]
 
-def makeTTFont(glyph_list_path):
-    glyphs = get_glyph_list(glyph_list_path)
+def makeTTFont(glyph_list_path, glyph_lists):
+    if glyph_list_path not in glyph_lists:
+        glyph_lists[glyph_list_path] = get_glyph_list(glyph_list_path)
+    glyphs = glyph_lists[glyph_list_path]
     font = TTFont()
-    font.setGlyphOrder(glyphs)
+    # copy, since the cached list is shared between fonts
+    font.setGlyphOrder(list(glyphs))
     # hack, but no need to modify the existing test files
     if "variations" in glyph_list_path:
         font["name"] = newTable("name")
@@ -22,32 +25,51 @@ def makeTTFont(glyph_list_path):
     return font
 
 def get_glyph_list(path):
-    with open(path) as f:
-        lines = f.read().splitlines()
-    return [l for l in lines if not l.startswith("#")]
+    with open(path, "rb") as f:
+        data = f.read()
+    # comment lines are dropped before decoding
+    return [l.decode() for l in data.splitlines() if not l.startswith(b"#")]
 
-def main():
-    try:
-        fea_path = sys.argv[1]
-        out_path = sys.argv[2]
-    except IndexError:
-        print("Usage: compile_fea.py <fea_file> <out_file>")
-        sys.exit(1)
+def file_exists(path, listings):
+    # inputs generally share a directory, so list each directory once rather
+    # than stat-ing every file individually
+    dir_path, name = os.path.split(path)
+    if dir_path not in listings:
+        try:
+            with os.scandir(dir_path or ".") as entries:
+                listings[dir_path] = {e.name for e in entries if e.is_file()}
+        except FileNotFoundError:
+            listings[dir_path] = set()
+    return name in listings[dir_path]
 
-
-    if not os.path.exists(fea_path):
+def compile_fea(fea_path, out_path, glyph_lists, listings):
+    if not file_exists(fea_path, listings):
         print("Feature file not found: " + fea_path)
         sys.exit(1)
     glyph_list_path = os.path.splitext(fea_path)[0] + "_glyphs.txt"
-    if not os.path.exists(glyph_list_path):
+    if not file_exists(glyph_list_path, listings):
         print("Glyph list file not found: " + glyph_list_path)
         sys.exit(1)
 
-    font = makeTTFont((glyph_list_path))
+    font = makeTTFont(glyph_list_path, glyph_lists)
     addOpenTypeFeatures(font, fea_path)
     # if you want to manually inspect you can dump as TTX:
     # font.saveXML(out_path, tables=[ 'GDEF', 'GSUB', 'GPOS'])
     font.save(out_path)
 
+def main():
+    # any number of <fea_file> <out_file> pairs can be compiled in a single
+    # invocation, so that the fontTools import is only paid once
+    args = sys.argv[1:]
+    if len(args) == 0 or len(args) % 2 != 0:
+        print("Usage: compile_fea.py <fea_file> <out_file> [<fea_file> <out_file> ...]")
+        sys.exit(1)
+
+    # glyph lists are parsed once per path and shared by all inputs
+    glyph_lists = {}
+    listings = {}
+    for fea_path, out_path in zip(args[0::2], args[1::2]):
+        compile_fea(fea_path, out_path, glyph_lists, listings)
+
 if __name__ == "__main__":
     main()
@@ -3,6 +3,8 @@
 
 import sys
 import os
+import ctypes
+import multiprocessing
 import freetype
 
 # Our requirements.txt pins freetype-py to version 2.4.0 which includes FreeType 2.13.0. We only
@@ -18,54 +20,184 @@ SAMPLE_SIZES = [0, 16, 50]
 # results among FreeType, freetype-py and read-fonts.
 SAMPLE_COORDS = [-1.0, -0.2000122, 0.0, 0.2999878, 1.0]
 
+# Scaled outlines are produced by FreeType in 26.6 fixed point.
+SCALE_FACTOR = 1.0 / 64.0
+
+# Buffer size used when writing the extracted data.
+OUTPUT_BUFFER_SIZE = 1 << 20
+
+
+# Point types, as given by the low two bits of an outline tag.
+TAG_CONIC = 0
+TAG_ON = 1
+TAG_CUBIC = 2
+
+
+def c_half(value):
+    # integer halving that truncates towards zero like C division
+    return value // 2 if value >= 0 else -(-value // 2)
+
 
 class DecomposeContext:
-    def __init__(self, is_scaled: bool, is_cff: bool):
-        self.data = ""
-        self.is_scaled = is_scaled
+    def __init__(self, is_cff: bool):
+        self.data = bytearray()
+        self.is_scaled = False
         self.is_cff = is_cff
         self.last_end = None
         self.last_move = None
 
+    def reset(self, is_scaled: bool):
+        del self.data[:]
+        self.is_scaled = is_scaled
+        self.last_end = None
+        self.last_move = None
+
     def add_element(self, cmd, points):
-        SCALE_FACTOR = 1.0 / 64.0
-        self.data += cmd + " "
         if self.is_scaled:
-            for point in points:
-                self.data += " {},{}".format(point.x *
-                                             SCALE_FACTOR, point.y * SCALE_FACTOR)
+            sf = SCALE_FACTOR
+            # %a gives the shortest repr of the float, like str(); %g would
+            # drop digits and trailing ".0" and change the extracted data
+            coords = b"".join([b" %a,%a" % (x * sf, y * sf) for x, y in points])
         else:
-            for point in points:
-                self.data += " {},{}".format(point.x, point.y)
+            coords = b"".join([b" %d,%d" % p for p in points])
         self.last_end = points[-1]
-        self.data += "\n"
+        self.data += b"%s %s\n" % (cmd, coords)
+
+    def move_to(self, pt):
+        self.add_element(b"m", [pt])
 
+    def line_to(self, pt):
+        # FreeType removes some (but not all!) degenerate lines for CFF outlines...
+        # Remove the rest here for consistency.
+        if not self.is_cff or self.last_end != pt:
+            self.add_element(b"l", [pt])
 
-def path_move_to(pt, ctx):
-    ctx.add_element("m", [pt])
+    def quad_to(self, c, pt):
+        self.add_element(b"q", [c, pt])
 
+    def cubic_to(self, c1, c2, pt):
+        self.add_element(b"c", [c1, c2, pt])
 
-def path_line_to(pt, ctx):
-    # FreeType removes some (but not all!) degenerate lines for CFF outlines...
-    # Remove the rest here for consistency.
-    if not ctx.is_cff or ctx.last_end != pt:
-        ctx.add_element("l", [pt])
+    def decompose(self, contours, points, tags):
+        """Emits path commands for an outline given as the raw arrays returned
+        by outline_arrays.
 
+        This is a port of FT_Outline_Decompose from FreeType 2.13.0 (with no
+        shift or delta) so that the outline is walked without a Python callback
+        from C for every segment.
+        """
+        points = list(zip(points[0::2], points[1::2]))
+        tags = [tag & 3 for tag in tags]
+        first = 0
+        for last in contours:
+            if last < first:
+                raise ValueError("invalid outline")
+            v_start = points[first]
+            v_last = points[last]
+            limit = last
+            i = first
+            tag = tags[first]
+            if tag == TAG_CUBIC:
+                raise ValueError("invalid outline")
+            if tag == TAG_CONIC:
+                # first point is off-curve: start at the last point if it is
+                # on-curve, otherwise at the implied point between the two
+                if tags[last] == TAG_ON:
+                    v_start = v_last
+                    limit -= 1
+                else:
+                    v_start = (c_half(v_start[0] + v_last[0]),
+                               c_half(v_start[1] + v_last[1]))
+                i -= 1
+            self.move_to(v_start)
+            closed = False
+            while i < limit:
+                i += 1
+                tag = tags[i]
+                if tag == TAG_ON:
+                    self.line_to(points[i])
+                elif tag == TAG_CONIC:
+                    v_control = points[i]
+                    while True:
+                        if i >= limit:
+                            self.quad_to(v_control, v_start)
+                            closed = True
+                            break
+                        i += 1
+                        vec = points[i]
+                        if tags[i] == TAG_ON:
+                            self.quad_to(v_control, vec)
+                            break
+                        if tags[i] != TAG_CONIC:
+                            raise ValueError("invalid outline")
+                        v_middle = (c_half(v_control[0] + vec[0]),
+                                    c_half(v_control[1] + vec[1]))
+                        self.quad_to(v_control, v_middle)
+                        v_control = vec
+                    if closed:
+                        break
+                else:
+                    if i + 1 > limit or tags[i + 1] != TAG_CUBIC:
+                        raise ValueError("invalid outline")
+                    i += 2
+                    if i <= limit:
+                        self.cubic_to(points[i - 2], points[i - 1], points[i])
+                    else:
+                        self.cubic_to(points[i - 2], points[i - 1], v_start)
+                        closed = True
+                        break
+            if not closed:
+                # close the contour with a line segment
+                self.line_to(v_start)
+            first = last + 1
 
-def path_quad_to(c, pt, ctx):
-    ctx.add_element("q", [c, pt])
 
+def outline_arrays(outline: freetype.Outline):
+    """Returns the contour end points, flattened (x, y) coordinates and tags of
+    an outline, sliced directly out of the underlying FreeType arrays."""
+    ft_outline = outline._FT_Outline
+    n_points = ft_outline.n_points
+    if n_points == 0:
+        return [], [], []
+    contours = ft_outline.contours[:ft_outline.n_contours]
+    points = ctypes.cast(ft_outline.points, ctypes.POINTER(
+        freetype.FT_Pos))[:2 * n_points]
+    tags = ft_outline.tags[:n_points]
+    return contours, points, tags
 
-def path_cubic_to(c1, c2, pt, ctx):
-    ctx.add_element("c", [c1, c2, pt])
+
+def set_pixel_sizes(face: freetype.Face, size):
+    # freetype doesn't like pixel sizes of 0, which we use for unscaled glyphs
+    if size == 0:
+        size = 16
+    face.set_pixel_sizes(size, size)
 
 
 class GlyphData:
-    def __init__(self):
-        self.data = ""
+    def __init__(self, face: freetype.Face):
+        self.data = bytearray()
+        self.decompose_ctx = DecomposeContext(face.get_format() == 'CFF')
+
+    def add_glyphs(self, face: freetype.Face, coords=[]):
+        # Sample every glyph at one size before moving to the next so the pixel
+        # size is only set once per size, but still emit the records grouped by
+        # glyph id.
+        records = [bytearray() for _ in range(face.num_glyphs)]
+        for size in SAMPLE_SIZES:
+            set_pixel_sizes(face, size)
+            for glyph_id, out in enumerate(records):
+                self.add_glyph(face, size, glyph_id, coords,
+                               set_size=False, out=out)
+        # join sizes the result exactly, rather than growing data per record
+        self.data += b"".join(records)
 
-    def add_glyph(self, face: freetype.Face, size, glyph_id, coords=[], hinting="none"):
-        face.set_pixel_sizes(size, size)
+    # Variation coordinates are set by the caller once per location; coords
+    # is only used to label the glyph record.
+    def add_glyph(self, face: freetype.Face, size, glyph_id, coords=[], hinting="none", set_size=True, out=None):
+        if set_size:
+            set_pixel_sizes(face, size)
+        if out is None:
+            out = self.data
         flags = freetype.FT_LOAD_NO_AUTOHINT | freetype.FT_LOAD_NO_BITMAP
         if hinting == "full":
             flags |= freetype.FT_LOAD_TARGET_NORMAL
@@ -78,73 +210,84 @@ class GlyphData:
             hinting = "none"
         if size == 0:
             flags |= freetype.FT_LOAD_NO_SCALE
-            # freetype doesn't like pixel sizes of 0
-            face.set_pixel_sizes(16, 16)
-        if len(coords):
-            face.set_var_blend_coords(coords)
         face.load_glyph(glyph_id, flags)
-        self.data += "glyph {} {} {}\n".format(glyph_id, size, hinting)
+        outline = face.glyph.outline
+        contours, points, tags = outline_arrays(outline)
+        out += b"glyph %d %d %s\n" % (glyph_id, size, hinting.encode())
         if len(coords) != 0:
-            self.data += "coords"
-            for coord in coords:
-                self.data += " " + str(coord)
-            self.data += "\n"
-        self.data += "contours"
-        for contour in face.glyph.outline.contours:
-            self.data += " " + str(contour)
-        self.data += "\npoints"
-        for point in face.glyph.outline.points:
-            self.data += " {},{}".format(point[0], point[1])
-        self.data += "\ntags"
-        for tag in face.glyph.outline.tags:
-            self.data += " " + str(tag)
-        self.data += "\n"
-        decompose_ctx = DecomposeContext(size != 0, face.get_format() == 'CFF')
-        face.glyph.outline.decompose(
-            context=decompose_ctx, move_to=path_move_to, line_to=path_line_to, conic_to=path_quad_to, cubic_to=path_cubic_to)
-        self.data += decompose_ctx.data
-        self.data += "-\n"
-
-
-font_path = sys.argv[1]
-
-font_dir = os.path.abspath(os.path.dirname(os.path.dirname(font_path)))
-out_dir = os.path.join(font_dir, "extracted")
-out_path = os.path.join(out_dir, os.path.splitext(
-    os.path.basename(font_path))[0]) + "-glyphs.txt"
-
-try:
+            out += b"coords%s\n" % b"".join([b" %a" % c for c in coords])
+        out += b"contours%s\n" % ((b" %d" * len(contours)) % tuple(contours))
+        out += b"points%s\n" % ((b" %d,%d" * len(tags)) % tuple(points))
+        out += b"tags%s\n" % ((b" %d" * len(tags)) % tuple(tags))
+        decompose_ctx = self.decompose_ctx
+        decompose_ctx.reset(size != 0)
+        decompose_ctx.decompose(contours, points, tags)
+        out += decompose_ctx.data
+        out += b"-\n"
+
+
+def extract_for_coord(args):
+    """Extracts all glyphs at a single location of a variable font.
+
+    Runs in a worker process so each location gets its own FreeType face.
+    """
+    font_path, axis_count, coord = args
     face = freetype.Face(font_path)
-    # make sure we have scalable outlines
-    assert(face.is_scalable)
-except:
-    # some of our fonts are not complete (e.g. missing hhea table) and will fail to
-    # load in FreeType
-    print("Skipping outline extraction for \"%s\"" % font_path)
-    exit(0)
-
-print("Extracting glyphs from \"%s\" to \"%s\"..." % (font_path, out_path))
-
-axis_count = 0
-
-try:
-    axis_count = len(face.get_var_design_coords())
-except:
-    pass
-
-glyphs = GlyphData()
-
-if axis_count > 0:
-    for coord in SAMPLE_COORDS:
-        coords = [coord] * axis_count
-        for glyph_id in range(0, face.num_glyphs):
-            for size in SAMPLE_SIZES:
-                glyphs.add_glyph(face, size, glyph_id, coords)
-else:
-    for glyph_id in range(0, face.num_glyphs):
-        for size in SAMPLE_SIZES:
-            glyphs.add_glyph(face, size, glyph_id)
+    coords = [coord] * axis_count
+    # always set the coordinates explicitly, even at the default location: an
+    # unset face does not necessarily produce the same outlines (see
+    # test_glyphs-glyf_colr_1_variable)
+    face.set_var_blend_coords(coords)
+    glyphs = GlyphData(face)
+    glyphs.add_glyphs(face, coords)
+    return glyphs.data
+
+
+def main():
+    font_path = sys.argv[1]
+
+    font_dir = os.path.abspath(os.path.dirname(os.path.dirname(font_path)))
+    out_dir = os.path.join(font_dir, "extracted")
+    out_path = os.path.join(out_dir, os.path.splitext(
+        os.path.basename(font_path))[0]) + "-glyphs.txt"
+
+    try:
+        face = freetype.Face(font_path)
+        # make sure we have scalable outlines
+        assert(face.is_scalable)
+    except:
+        # some of our fonts are not complete (e.g. missing hhea table) and will fail to
+        # load in FreeType
+        print("Skipping outline extraction for \"%s\"" % font_path)
+        exit(0)
+
+    print("Extracting glyphs from \"%s\" to \"%s\"..." % (font_path, out_path))
+
+    axis_count = 0
+
+    try:
+        axis_count = len(face.get_var_design_coords())
+    except:
+        pass
+
+    if axis_count > 0:
+        # each location is independent, so sample them in parallel and
+        # append the results in SAMPLE_COORDS order, skipping any repeated
+        # locations
+        coords = list(dict.fromkeys(SAMPLE_COORDS))
+        jobs = [(font_path, axis_count, coord) for coord in coords]
+        with multiprocessing.Pool(min(len(jobs), os.cpu_count() or 1)) as pool:
+            data = b"".join(pool.imap(extract_for_coord, jobs))
+    else:
+        glyphs = GlyphData(face)
+        glyphs.add_glyphs(face)
+        data = glyphs.data
+
+    # outputs can be several megabytes; use a large buffer so they are
+    # written in as few syscalls as possible
+    with open(out_path, "wb", buffering=OUTPUT_BUFFER_SIZE) as f:
+        f.write(data)
+
 
-f = open(out_path, "w")
-f.write(glyphs.data)
-f.close()
+if __name__ == "__main__":
+    main()
@@ -38,7 +38,9 @@ for f in $(ls $SRC_DIR/*.ttx); do
     $VENV_DIR/bin/python $EXTRACT_GLYPHS $OUT_DIR/$(basename "$f" .ttx).ttf
 done
 
-# compile FEA sources
+# compile FEA sources in a single invocation
+FEA_ARGS=()
 for f in $(ls $FEA_DIR/*.fea); do
-    $VENV_DIR/bin/python $COMPILE_FEA $f $OUT_DIR/$(basename "$f" .fea).ttf
+    FEA_ARGS+=("$f" "$OUT_DIR/$(basename "$f" .fea).ttf")
 done
+$VENV_DIR/bin/python $COMPILE_FEA "${FEA_ARGS[@]}"